@@ -11,9 +11,12 @@ use chrono::{DateTime, Timelike, Utc};
 use num::{ToPrimitive, Zero};
 use rust_decimal::Decimal;
 use serde::{Deserialize, Serialize};
-use std::collections::BTreeMap;
+use std::collections::{BTreeMap, HashMap, HashSet};
 use std::fs::File;
+use std::io::{BufWriter, Write};
 use std::path::PathBuf;
+use std::sync::Arc;
+use std::thread::JoinHandle;
 use structopt::StructOpt;
 use url::Url;
 
@@ -99,10 +102,9 @@ struct PersistentStateFile {
 impl PersistentStateFile {
     fn open<P: Into<PathBuf>>(datadir: P) -> Result<PersistentStateFile, failure::Error> {
         let filename = datadir.into().join("logger-state/state.json");
-        let fh = File::open(&filename);
-        let state = fh
+        let state = std::fs::read(&filename)
             .ok()
-            .and_then(|fh| serde_json::from_reader(fh).ok())
+            .and_then(|contents| serde_json::from_slice(&contents).ok())
             .unwrap_or_default();
         Ok(PersistentStateFile { filename, state })
     }
@@ -134,11 +136,11 @@ struct Snapshot {
 struct PerProjectInfo<'a> {
     categorized_server_costs_by_project: BTreeMap<
         BillingCategory,
-        BTreeMap<String, Vec<(Option<Decimal>, &'a openstack::nova::Server)>>,
+        BTreeMap<&'a str, Vec<(Option<Decimal>, &'a openstack::nova::Server)>>,
     >,
     volume_costs_by_project:
-        BTreeMap<String, Vec<(Option<Decimal>, &'a openstack::cinder::Volume)>>,
-    image_costs_by_project: BTreeMap<String, Vec<(Option<Decimal>, &'a openstack::glance::Image)>>,
+        BTreeMap<&'a str, Vec<(Option<Decimal>, &'a openstack::cinder::Volume)>>,
+    image_costs_by_project: BTreeMap<&'a str, Vec<(Option<Decimal>, &'a openstack::glance::Image)>>,
 }
 
 impl<'a> PerProjectInfo<'a> {
@@ -154,7 +156,7 @@ impl<'a> PerProjectInfo<'a> {
 fn collate_breakdowns(ppi: &PerProjectInfo) {
     // Group by instance status
 
-    let mut project_breakdowns: BTreeMap<String, ProjectBreakdown> = BTreeMap::new();
+    let mut project_breakdowns: BTreeMap<&str, ProjectBreakdown> = BTreeMap::new();
 
     if let Some(category) = ppi
         .categorized_server_costs_by_project
@@ -171,7 +173,7 @@ fn collate_breakdowns(ppi: &PerProjectInfo) {
                 proj, total_cost, costs
             );
             project_breakdowns
-                .entry(proj.clone())
+                .entry(*proj)
                 .or_default()
                 .active
                 .extend(server_costs.iter());
@@ -193,7 +195,7 @@ fn collate_breakdowns(ppi: &PerProjectInfo) {
                 proj, total_cost, costs
             );
             project_breakdowns
-                .entry(proj.clone())
+                .entry(*proj)
                 .or_default()
                 .inert
                 .extend(server_costs.iter());
@@ -215,7 +217,7 @@ fn collate_breakdowns(ppi: &PerProjectInfo) {
                 proj, total_cost, costs
             );
             project_breakdowns
-                .entry(proj.clone())
+                .entry(*proj)
                 .or_default()
                 .inert
                 .extend(server_costs.iter());
@@ -233,7 +235,7 @@ fn collate_breakdowns(ppi: &PerProjectInfo) {
             proj, total_cost, costs
         );
         project_breakdowns
-            .entry(proj.clone())
+            .entry(*proj)
             .or_default()
             .volumes
             .extend(volume_costs.iter());
@@ -250,45 +252,68 @@ fn collate_breakdowns(ppi: &PerProjectInfo) {
             proj, total_cost, costs
         );
         project_breakdowns
-            .entry(proj.clone())
+            .entry(*proj)
             .or_default()
             .images
             .extend(image_costs.iter());
     }
 }
 
+// Runs a session request on its own thread so that independent requests overlap.
+fn spawn_fetch<T, F>(
+    session: &Arc<openstack::Session>,
+    fetch: F,
+) -> JoinHandle<Result<T, failure::Error>>
+where
+    T: Send + 'static,
+    F: FnOnce(&openstack::Session) -> Result<T, failure::Error> + Send + 'static,
+{
+    let session = Arc::clone(session);
+    std::thread::spawn(move || fetch(&session))
+}
+
+fn join_fetch<T>(handle: JoinHandle<Result<T, failure::Error>>) -> Result<T, failure::Error> {
+    handle
+        .join()
+        .map_err(|_| format_err!("API request thread panicked"))?
+}
+
 fn main() -> Result<(), failure::Error> {
     env_logger::init();
 
     let opt = Opt::from_args();
     info!("Loading configuration from {:?}", &opt.config);
-    let cfg: Config = serde_json::from_reader(File::open(&opt.config)?)?;
+    let cfg: Config = serde_json::from_slice(&std::fs::read(&opt.config)?)?;
     let datadir = PathBuf::from(&cfg.datadir);
     info!("Opening persistent state file in {}", &cfg.datadir);
     let mut persistent_state = PersistentStateFile::open(&cfg.datadir)?;
 
-    let costs_path = datadir.join("logger-state/costs.json");
-    info!("Reading costs from {:?}", &costs_path);
-    let costs: Costs = serde_json::from_reader(File::open(&costs_path)?)?;
-
-    let region_costs = costs
-        .regions
-        .get(&cfg.region)
-        .ok_or(format_err!("Region {} not found in costs.json", cfg.region))?;
-
     let now = Utc::now();
     let this_run_datetime = now.date().and_hms(now.hour(), 0, 0);
     if !opt.force {
         if let Some(last_run) = persistent_state.state.last_timepoint {
             if last_run == this_run_datetime {
+                info!(
+                    "Hour {} already processed, nothing to do",
+                    this_run_datetime
+                );
                 return Ok(());
             }
         }
     }
 
+    let costs_path = datadir.join("logger-state/costs.json");
+    info!("Reading costs from {:?}", &costs_path);
+    let costs: Costs = serde_json::from_slice(&std::fs::read(&costs_path)?)?;
+
+    let region_costs = costs
+        .regions
+        .get(&cfg.region)
+        .ok_or(format_err!("Region {} not found in costs.json", cfg.region))?;
+
     let snap = if let Some(snap_path) = opt.load_snapshot {
-        let snap: Snapshot =
-            serde_json::from_str(&std::fs::read_to_string(snap_path).unwrap()).unwrap();
+        info!("Loading snapshot from {:?}", &snap_path);
+        let snap: Snapshot = serde_json::from_slice(&std::fs::read(snap_path)?)?;
         snap
     } else {
         let credentials = openstack::Credentials {
@@ -298,21 +323,34 @@ fn main() -> Result<(), failure::Error> {
             project: cfg.project,
         };
 
-        let session = openstack::Session::new(
+        let session = Arc::new(openstack::Session::new(
             &credentials,
             &cfg.keystone_url,
             &cfg.region,
             opt.rewrite_host,
-        )?;
-
-        let servers = session.servers()?;
-        let flavors = session.flavors()?;
-        let images = session.images()?;
-        let volumes = session.volumes()?;
-        let object_bucket_stats = radosgw::admin::bucket_stats();
-
-        let users = session.user_mappings()?;
-        let projects = session.project_mappings()?;
+        )?);
+
+        // radosgw-admin runs as a separate process, let it work while the API calls are in flight.
+        let bucket_stats_thread = std::thread::spawn(radosgw::admin::bucket_stats);
+
+        // The API requests are independent of each other, issue them all at once over the
+        // session's shared connection pool.
+        let servers = spawn_fetch(&session, openstack::Session::servers);
+        let flavors = spawn_fetch(&session, openstack::Session::flavors);
+        let images = spawn_fetch(&session, openstack::Session::images);
+        let volumes = spawn_fetch(&session, openstack::Session::volumes);
+        let users = spawn_fetch(&session, openstack::Session::user_mappings);
+        let projects = spawn_fetch(&session, openstack::Session::project_mappings);
+
+        let servers = join_fetch(servers)?;
+        let flavors = join_fetch(flavors)?;
+        let images = join_fetch(images)?;
+        let volumes = join_fetch(volumes)?;
+        let users = join_fetch(users)?;
+        let projects = join_fetch(projects)?;
+        let object_bucket_stats = bucket_stats_thread
+            .join()
+            .unwrap_or_else(|_| Err(format_err!("radosgw-admin bucket stats thread panicked")));
 
         let snap = Snapshot {
             version: 1,
@@ -327,7 +365,10 @@ fn main() -> Result<(), failure::Error> {
         };
 
         if let Some(snap_path) = opt.save_snapshot {
-            std::fs::write(snap_path, &serde_json::to_string_pretty(&snap).unwrap()).unwrap();
+            info!("Saving snapshot to {:?}", &snap_path);
+            let mut fh = BufWriter::new(File::create(snap_path)?);
+            serde_json::to_writer_pretty(&mut fh, &snap)?;
+            fh.flush()?;
         }
 
         snap
@@ -365,13 +406,32 @@ fn main() -> Result<(), failure::Error> {
     let duration = chrono::Duration::hours(1);
     let end_time = start_time + duration;
 
+    // Every record written by this run shares the same creation time.
+    let create_time = Utc::now();
+
+    // Decimal conversion factor shared by the per-image and per-bucket loops.
+    let bytes_per_gb = Decimal::from(1024u64.pow(3));
+
     // Operator test project - "SNIC 2018/10-1"
     let _op_servers = snap
         .servers
         .iter()
         .filter(|srv| srv.tenant_id == "7d4b838241d9486e972bf1b371cc8718");
 
-    let mut used_os_volume_discount: BTreeMap<String, u64> = BTreeMap::new();
+    let mut used_os_volume_discount: HashMap<&str, u64> = HashMap::new();
+    let mut unpriced_flavors: HashSet<&str> = HashSet::new();
+
+    // Resolve each flavor's cost once instead of once per server.
+    let flavor_costs: HashMap<&str, (&openstack::nova::Flavor, Option<Decimal>)> = snap
+        .flavors
+        .iter()
+        .map(|(id, flavor)| {
+            (
+                id.as_str(),
+                (flavor, region_costs.get(&flavor.name).cloned()),
+            )
+        })
+        .collect();
 
     let mut ppi = PerProjectInfo::new();
 
@@ -389,7 +449,7 @@ fn main() -> Result<(), failure::Error> {
 
         let user = snap.users.get(&server.user_id);
         let project = snap.projects.get(&server.tenant_id);
-        let flavor = snap.flavors.get(&server.flavor.id);
+        let flavor = flavor_costs.get(server.flavor.id.as_str());
 
         let image_backed = match &server.image {
             nova::Image::StringRep(x) => x != "",
@@ -403,24 +463,27 @@ fn main() -> Result<(), failure::Error> {
         // );
         // debug!("{:?}", server);
 
-        if let (Some(user), Some(project), Some(flavor)) = (user, project, flavor) {
-            let cost = region_costs.get(&flavor.name).cloned();
+        if let (Some(user), Some(project), Some(&(flavor, cost))) = (user, project, flavor) {
+            if cost.is_none() && unpriced_flavors.insert(flavor.name.as_str()) {
+                warn!(
+                    "No cost for flavor {} in region {}, its instances are not billed",
+                    flavor.name, cfg.region
+                );
+            }
 
             let billing_category = BillingCategory::from_status(server.status.as_ref());
 
             ppi.categorized_server_costs_by_project
                 .entry(billing_category)
                 .or_default()
-                .entry(server.tenant_id.clone())
+                .entry(server.tenant_id.as_str())
                 .or_default()
                 .push((cost, server));
 
             if volume_backed {
-                used_os_volume_discount.insert(server.attached_volumes[0].id.clone(), flavor.disk);
+                used_os_volume_discount.insert(server.attached_volumes[0].id.as_str(), flavor.disk);
             }
 
-            let create_time = Utc::now();
-
             if let Some(cost) = cost {
                 if !cost.is_zero() {
                     let allocated_disk = flavor.disk * 1024u64.pow(3);
@@ -431,7 +494,7 @@ fn main() -> Result<(), failure::Error> {
 
                     let cr = CloudComputeRecord {
                         common: CloudRecordCommon {
-                            create_time: create_time,
+                            create_time,
                             site: cfg.site.clone(),
                             project,
                             user,
@@ -460,22 +523,25 @@ fn main() -> Result<(), failure::Error> {
         }
     }
 
+    // Volumes and images are both billed at the block storage rate.
+    let block_gig_rate = region_costs.get("storage.block").cloned();
+
     info!("Processing volumes");
     for volume in &snap.volumes {
-        let gig_rate = region_costs.get("storage.block").cloned();
-        let discount = used_os_volume_discount.get(&volume.id).unwrap_or(&0);
+        let discount = used_os_volume_discount
+            .get(volume.id.as_str())
+            .unwrap_or(&0);
         let actual_gigs = volume.size;
         let discount_gigs = volume.size.saturating_sub(*discount);
-        let cost = gig_rate.map(|r| Decimal::from(discount_gigs) * r);
+        let cost = block_gig_rate.map(|r| Decimal::from(discount_gigs) * r);
         ppi.volume_costs_by_project
-            .entry(volume.tenant_id.clone())
+            .entry(volume.tenant_id.as_str())
             .or_default()
             .push((cost, volume));
 
         let user = snap.users.get(&volume.user_id);
         let project = snap.projects.get(&volume.tenant_id);
 
-        let create_time = Utc::now();
         let allocated_disk = actual_gigs * 1024u64.pow(3);
 
         if let (Some(cost), Some(user), Some(project)) = (cost, user, project) {
@@ -483,7 +549,7 @@ fn main() -> Result<(), failure::Error> {
                 use records::v1::{CloudRecordCommon, CloudStorageRecord};
                 let sr = CloudStorageRecord {
                     common: CloudRecordCommon {
-                        create_time: create_time,
+                        create_time,
                         site: cfg.site.clone(),
                         project,
                         user,
@@ -507,26 +573,24 @@ fn main() -> Result<(), failure::Error> {
 
     info!("Processing images");
     for image in &snap.images {
-        let gig_rate = region_costs.get("storage.block").cloned();
         if let (Some(bytes), Some(owner)) = (image.size, &image.owner) {
-            let cost = gig_rate.map(|r| Decimal::from(bytes) / Decimal::from(1024u64.pow(3)) * r);
+            let cost = block_gig_rate.map(|r| Decimal::from(bytes) / bytes_per_gb * r);
             ppi.image_costs_by_project
-                .entry(owner.clone())
+                .entry(owner.as_str())
                 .or_default()
                 .push((cost, image));
 
             let user = snap
                 .users
-                .get(&image.user_id.as_ref().unwrap_or(&DEFAULT_USER.to_owned()));
+                .get(image.user_id.as_ref().map_or(DEFAULT_USER, String::as_str));
             let project = snap.projects.get(
-                &image
+                image
                     .owner_id
                     .as_ref()
                     .or(image.owner.as_ref())
-                    .unwrap_or(&DEFAULT_PROJECT.to_owned()),
+                    .map_or(DEFAULT_PROJECT, String::as_str),
             );
 
-            let create_time = Utc::now();
             let allocated_disk = bytes;
 
             if let (Some(cost), Some(user), Some(project)) = (cost, user, project) {
@@ -534,7 +598,7 @@ fn main() -> Result<(), failure::Error> {
                     use records::v1::{CloudRecordCommon, CloudStorageRecord};
                     let sr = CloudStorageRecord {
                         common: CloudRecordCommon {
-                            create_time: create_time,
+                            create_time,
                             site: cfg.site.clone(),
                             project,
                             user,
@@ -560,14 +624,12 @@ fn main() -> Result<(), failure::Error> {
     info!("Processing object buckets");
     for (_, (cost, stat, gigs)) in &object_bucket_costs {
         if let Some(project) = snap.projects.get(&stat.owner) {
-            let create_time = Utc::now();
-            let gb_to_b: Decimal = 1024u64.pow(3).into();
-            let bytes = gigs * gb_to_b;
+            let bytes = gigs * bytes_per_gb;
 
             use records::v1::{CloudRecordCommon, CloudStorageRecord};
             let sr = CloudStorageRecord {
                 common: CloudRecordCommon {
-                    create_time: create_time,
+                    create_time,
                     site: cfg.site.clone(),
                     project,
                     user: DEFAULT_USER.to_owned(),
@@ -592,7 +654,10 @@ fn main() -> Result<(), failure::Error> {
     debug!("total volumes: {}", snap.volumes.len());
     debug!("used OS volumes: {}", used_os_volume_discount.len());
 
-    collate_breakdowns(&ppi);
+    // The breakdowns are only ever logged, skip the work when nobody is listening.
+    if log_enabled!(log::Level::Debug) {
+        collate_breakdowns(&ppi);
+    }
 
     if !opt.dry_run {
         let xml_dir = PathBuf::from(cfg.datadir).join("records");
@@ -600,8 +665,13 @@ fn main() -> Result<(), failure::Error> {
         std::fs::create_dir_all(&xml_dir)?;
         let xml_leaf_name = format!("{}.xml", this_run_datetime.format("%Y%m%dT%H%MZ"));
         let xml_filename = xml_dir.join(xml_leaf_name);
-        let fh = std::fs::File::create(xml_filename)?;
-        records::v1::write_xml_to(fh, v1_compute_records.iter(), v1_storage_records.iter())?;
+        let mut fh = BufWriter::new(File::create(xml_filename)?);
+        records::v1::write_xml_to(
+            &mut fh,
+            v1_compute_records.iter(),
+            v1_storage_records.iter(),
+        )?;
+        fh.flush()?;
 
         info!("Persisting state");
         persistent_state.state.last_timepoint = Some(this_run_datetime);
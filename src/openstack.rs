@@ -1,14 +1,14 @@
 extern crate failure;
 extern crate serde_json;
 
-use reqwest::header::CONTENT_TYPE;
+use reqwest::header::{HeaderMap, HeaderValue};
 use serde::{Deserialize, Serialize};
 use std::collections::HashMap;
 use url::Url;
 
 #[derive(Debug)]
 pub struct Session {
-    auth_token: String,
+    client: reqwest::Client,
     keystone_url: Url,
     nova_url: Url,
     cinder_url: Url,
@@ -75,7 +75,7 @@ pub struct Credentials {
 }
 
 impl Session {
-    fn auth_scoped_payload(creds: &Credentials) -> String {
+    fn auth_scoped_payload(creds: &Credentials) -> serde_json::Value {
         json!({"auth": {
             "identity": {
                 "methods": ["password"],
@@ -94,7 +94,6 @@ impl Session {
                 }
             }
         }})
-        .to_string()
     }
 
     pub fn new(
@@ -108,11 +107,10 @@ impl Session {
             url.path_segments_mut().unwrap().pop_if_empty().push(""); // ensure that the URL ends in a slash
             url
         };
-        let client = reqwest::Client::new();
-        let mut res = client
+        let auth_client = reqwest::Client::new();
+        let mut res = auth_client
             .post(keystone_url.join("auth/tokens/")?.as_str())
-            .header(CONTENT_TYPE, "application/json")
-            .body(Session::auth_scoped_payload(&creds))
+            .json(&Session::auth_scoped_payload(&creds))
             .send()?;
         trace!("{:?}", res);
         let admin_scoped_token: String = res
@@ -122,11 +120,17 @@ impl Session {
             .to_str()
             .unwrap()
             .to_owned();
-        let body = res.text()?;
-        let token_info: keystone::TokenInfo = serde_json::from_str(&body)?;
+        let token_info: keystone::TokenInfo = res.json()?;
         trace!("{:#?}", token_info);
         trace!("Admin scoped token: {}", admin_scoped_token);
 
+        // Every later request is made with the admin scoped token.
+        let mut default_headers = HeaderMap::new();
+        default_headers.insert("X-Auth-Token", HeaderValue::from_str(&admin_scoped_token)?);
+        let client = reqwest::Client::builder()
+            .default_headers(default_headers)
+            .build()?;
+
         let region_endpoints = token_info
             .token
             .catalog
@@ -167,7 +171,7 @@ impl Session {
         }
 
         Ok(Session {
-            auth_token: admin_scoped_token,
+            client,
             keystone_url: keystone_url,
             nova_url,
             cinder_url,
@@ -208,33 +212,23 @@ pub mod cinder {
 }
 
 impl Session {
-    fn fetch_volume_set(
-        &self,
-        client: &reqwest::Client,
-        url: &url::Url,
-    ) -> Result<cinder::Volumes, failure::Error> {
-        let mut res = client
-            .get(url.as_str())
-            .header("X-Auth-Token", self.auth_token.as_str())
-            .send()?;
+    fn fetch_volume_set(&self, url: &url::Url) -> Result<cinder::Volumes, failure::Error> {
+        let mut res = self.client.get(url.as_str()).send()?;
 
         if !res.status().is_success() {
-            bail!("Could not retrieve volumes from Glance");
+            bail!("Could not retrieve volumes from Cinder");
         }
 
-        let text = res.text()?;
-        // std::fs::write("volumes.json", &text)?;
-        let volumes: cinder::Volumes = serde_json::from_str(&text)?;
+        let volumes: cinder::Volumes = res.json()?;
         Ok(volumes)
     }
 
     pub fn volumes(&self) -> Result<Vec<cinder::Volume>, failure::Error> {
-        let client = reqwest::Client::new();
         let mut url = self.cinder_url.join("volumes/detail?all_tenants=1")?;
 
         let mut ret = Vec::new();
         loop {
-            let mut volumes = self.fetch_volume_set(&client, &url)?;
+            let mut volumes = self.fetch_volume_set(&url)?;
             ret.append(&mut volumes.volumes);
             trace!("{:#?}", volumes.links);
             if let Some(next) = volumes.links.iter().find(|lnk| lnk.rel == "next") {
@@ -264,19 +258,16 @@ pub type Flavors = HashMap<String, nova::Flavor>;
 
 impl Session {
     fn users(&self) -> Result<keystone::Users, failure::Error> {
-        let client = reqwest::Client::new();
-        let mut res = client
+        let mut res = self
+            .client
             .get(self.keystone_url.join("users/")?.as_str())
-            .header("X-Auth-Token", self.auth_token.as_str())
             .send()?;
 
         if !res.status().is_success() {
             bail!("Could not retrieve users from Keystone");
         }
 
-        let text = res.text()?;
-        // std::fs::write("users.json", &text)?;
-        let users: keystone::Users = serde_json::from_str(&text)?;
+        let users: keystone::Users = res.json()?;
         Ok(users)
     }
 
@@ -292,19 +283,16 @@ impl Session {
     }
 
     pub fn project_mappings(&self) -> Result<NameMapping, failure::Error> {
-        let client = reqwest::Client::new();
-        let mut res = client
+        let mut res = self
+            .client
             .get(self.keystone_url.join("projects/")?.as_str())
-            .header("X-Auth-Token", self.auth_token.as_str())
             .send()?;
 
         if !res.status().is_success() {
             bail!("Could not retrieve projects from Keystone");
         }
 
-        let text = res.text()?;
-        // std::fs::write("projects.json", &text)?;
-        let projects: keystone::Projects = serde_json::from_str(&text)?;
+        let projects: keystone::Projects = res.json()?;
 
         let mut id_to_name = HashMap::new();
         for proj in projects.projects {
@@ -315,21 +303,15 @@ impl Session {
     }
 
     pub fn flavors(&self) -> Result<Flavors, failure::Error> {
-        let client = reqwest::Client::new();
         let url = self.nova_url.join("flavors/detail?is_public=None")?;
         trace!("flavor url: {:?}", url);
-        let mut res = client
-            .get(url.as_str())
-            .header("X-Auth-Token", self.auth_token.as_str())
-            .send()?;
+        let mut res = self.client.get(url.as_str()).send()?;
 
         if !res.status().is_success() {
             bail!("Could not retrieve flavors from Nova");
         }
 
-        let text = res.text()?;
-        // std::fs::write("flavors.json", &text)?;
-        let flavors: nova::Flavors = serde_json::from_str(&text)?;
+        let flavors: nova::Flavors = res.json()?;
 
         let mut ret = HashMap::new();
         for flavor in flavors.flavors {
@@ -378,34 +360,27 @@ pub mod glance {
 }
 
 impl Session {
-    fn fetch_image_set(
-        &self,
-        client: &reqwest::Client,
-        url: &url::Url,
-    ) -> Result<glance::Images, failure::Error> {
-        let mut res = client
-            .get(url.as_str())
-            .header("X-Auth-Token", self.auth_token.as_str())
-            .send()?;
+    fn fetch_image_set(&self, url: &url::Url) -> Result<glance::Images, failure::Error> {
+        let mut res = self.client.get(url.as_str()).send()?;
 
         if !res.status().is_success() {
             bail!("Could not retrieve images from Glance");
         }
 
-        let text = res.text()?;
-        // std::fs::write("images.json", &text)?;
-        let images: glance::Images = serde_json::from_str(&text)?;
+        let images: glance::Images = res.json()?;
         Ok(images)
     }
 
     pub fn images(&self) -> Result<Vec<glance::Image>, failure::Error> {
-        let client = reqwest::Client::new();
         let base_url = self.glance_url.join("v2/images")?;
         let mut url = base_url.clone();
+        // Glance pages 25 images at a time by default, ask for its configured maximum instead.
+        // The next links it returns carry the limit along.
+        url.query_pairs_mut().append_pair("limit", "1000");
 
         let mut ret = Vec::new();
         loop {
-            let mut images = self.fetch_image_set(&client, &url)?;
+            let mut images = self.fetch_image_set(&url)?;
             ret.append(&mut images.images);
             if let Some(next) = images.next {
                 url = base_url.join(&next)?;
@@ -477,23 +452,17 @@ pub mod nova {
 impl Session {
     /// Obtain a list of servers from the API.
     pub fn servers(&self) -> Result<Vec<nova::Server>, failure::Error> {
-        let client = reqwest::Client::new();
         let mut req_url = self.nova_url.join("servers/detail")?;
         req_url.query_pairs_mut().append_pair("all_tenants", "True");
 
-        let mut res = client
-            .get(req_url.as_str())
-            .header("X-Auth-Token", self.auth_token.as_str())
-            .send()?;
+        let mut res = self.client.get(req_url.as_str()).send()?;
 
         trace!("{:?}", &res);
         if !res.status().is_success() {
-            bail!("Could not retrieve instances from Keystone");
+            bail!("Could not retrieve instances from Nova");
         }
 
-        let text = res.text()?;
-        // std::fs::write("servers.json", &text)?;
-        let servers: nova::Servers = serde_json::from_str(&text)?;
+        let servers: nova::Servers = res.json()?;
 
         Ok(servers.servers)
     }
@@ -513,23 +482,14 @@ pub mod swift {
 }
 
 impl Session {
-    fn fetch_container_set(
-        &self,
-        client: &reqwest::Client,
-        url: &url::Url,
-    ) -> Result<Vec<swift::Container>, failure::Error> {
-        let mut res = client
-            .get(url.as_str())
-            .header("X-Auth-Token", self.auth_token.as_str())
-            .send()?;
+    fn fetch_container_set(&self, url: &url::Url) -> Result<Vec<swift::Container>, failure::Error> {
+        let mut res = self.client.get(url.as_str()).send()?;
 
         if !res.status().is_success() {
-            bail!("Could not retrieve images from Glance");
+            bail!("Could not retrieve containers from Swift");
         }
 
-        let text = res.text()?;
-        // std::fs::write("containers.json", &text)?;
-        let containers: Vec<swift::Container> = serde_json::from_str(&text)?;
+        let containers: Vec<swift::Container> = res.json()?;
         Ok(containers)
     }
 
@@ -538,7 +498,6 @@ impl Session {
         return Ok(vec![]);
 
         if let Some(swift_url) = self.swift_url {
-            let client = reqwest::Client::new();
             let base_url = swift_url.join(project)?;
             let marker: Option<String> = None;
 
@@ -550,7 +509,7 @@ impl Session {
                     qp.append_pair("marker", &marker);
                 }
                 drop(qp);
-                let mut containers = self.fetch_container_set(&client, &url)?;
+                let mut containers = self.fetch_container_set(&url)?;
                 let done = containers.len() == 0;
                 ret.append(&mut containers);
                 if done {
@@ -38,10 +38,10 @@ pub mod admin {
         let output = subprocess::Exec::cmd("radosgw-admin")
             .args(&["bucket", "stats"])
             .capture()?
-            .stdout_str();
-        trace!("{}", output);
+            .stdout;
+        trace!("{}", String::from_utf8_lossy(&output));
         // std::fs::write("bucket_stats.json", &output).unwrap();
-        let statses: Vec<BucketStats> = serde_json::from_str(&output)?;
+        let statses: Vec<BucketStats> = serde_json::from_slice(&output)?;
         Ok(statses)
     }
 }
@@ -7,6 +7,11 @@ use xml::writer::{EventWriter, XmlEvent};
 
 trait EventWriterExt {
     fn write_simple_element(&mut self, name: &str, value: &str) -> Result<(), failure::Error>;
+    fn write_optional_element<T: ToString>(
+        &mut self,
+        name: &str,
+        value: Option<T>,
+    ) -> Result<(), failure::Error>;
 }
 
 impl<W: Write> EventWriterExt for EventWriter<W> {
@@ -17,6 +22,18 @@ impl<W: Write> EventWriterExt for EventWriter<W> {
 
         Ok(())
     }
+
+    fn write_optional_element<T: ToString>(
+        &mut self,
+        name: &str,
+        value: Option<T>,
+    ) -> Result<(), failure::Error> {
+        if let Some(v) = value {
+            self.write_simple_element(name, &v.to_string())?;
+        }
+
+        Ok(())
+    }
 }
 
 pub trait WriteToXML {
@@ -93,6 +110,48 @@ pub mod v1 {
         pub allocated_disk: u64,
     }
 
+    impl CloudRecordCommon {
+        /// Writes the record identity and ownership elements that open every record.
+        fn write_identity_to<W: Write>(
+            &self,
+            w: &mut EventWriter<W>,
+        ) -> Result<(), failure::Error> {
+            w.write(
+                XmlEvent::start_element("cr:RecordIdentity")
+                    .attr("cr:createTime", &self.create_time.to_rfc3339())
+                    .attr(
+                        "cr:recordId",
+                        &format!(
+                            "ssc/{}/cr/{}/{}",
+                            self.site,
+                            self.instance_id,
+                            self.end_time.timestamp()
+                        ),
+                    ),
+            )?;
+            w.write(XmlEvent::end_element())?;
+
+            w.write_simple_element("cr:Site", &self.site)?;
+            w.write_simple_element("cr:Project", &self.project)?;
+            w.write_simple_element("cr:User", &self.user)?;
+            w.write_simple_element("cr:InstanceId", &self.instance_id)?;
+
+            Ok(())
+        }
+
+        /// Writes the accounting period and placement elements shared by all record types.
+        fn write_period_to<W: Write>(&self, w: &mut EventWriter<W>) -> Result<(), failure::Error> {
+            w.write_simple_element("cr:StartTime", &self.start_time.to_rfc3339())?;
+            w.write_simple_element("cr:EndTime", &self.end_time.to_rfc3339())?;
+            w.write_simple_element("cr:Duration", &self.duration.to_string())?;
+            w.write_simple_element("cr:Region", &self.region)?;
+            w.write_simple_element("cr:Resource", &self.resource)?;
+            w.write_simple_element("cr:Zone", &self.zone)?;
+
+            Ok(())
+        }
+    }
+
     #[derive(Debug)]
     pub struct CloudComputeRecord {
         pub common: CloudRecordCommon,
@@ -152,52 +211,19 @@ pub mod v1 {
             let common = &self.common;
             w.write(XmlEvent::start_element("cr:CloudComputeRecord"))?;
 
-            w.write(
-                XmlEvent::start_element("cr:RecordIdentity")
-                    .attr("cr:createTime", &common.create_time.to_rfc3339())
-                    .attr(
-                        "cr:recordId",
-                        &format!(
-                            "ssc/{}/cr/{}/{}",
-                            common.site,
-                            common.instance_id,
-                            common.end_time.timestamp()
-                        ),
-                    ),
-            )?;
-            w.write(XmlEvent::end_element())?;
-
-            w.write_simple_element("cr:Site", &common.site)?;
-            w.write_simple_element("cr:Project", &common.project)?;
-            w.write_simple_element("cr:User", &common.user)?;
-            w.write_simple_element("cr:InstanceId", &common.instance_id)?;
-            w.write_simple_element("cr:StartTime", &common.start_time.to_rfc3339())?;
-            w.write_simple_element("cr:EndTime", &common.end_time.to_rfc3339())?;
-            w.write_simple_element("cr:Duration", &common.duration.to_string())?;
-            w.write_simple_element("cr:Region", &common.region)?;
-            w.write_simple_element("cr:Resource", &common.resource)?;
-            w.write_simple_element("cr:Zone", &common.zone)?;
+            common.write_identity_to(w)?;
+            common.write_period_to(w)?;
             w.write_simple_element("cr:Flavour", &self.flavour)?;
             w.write_simple_element("cr:Cost", &common.cost.to_string())?;
             w.write_simple_element("cr:AllocatedCPU", &self.allocated_cpu.to_string())?;
             w.write_simple_element("cr:AllocatedDisk", &common.allocated_disk.to_string())?;
             w.write_simple_element("cr:AllocatedMemory", &self.allocated_memory.to_string())?;
 
-            if let Some(v) = self.used_cpu {
-                w.write_simple_element("cr:UsedCPU", &v.to_string())?;
-            }
-            if let Some(v) = self.used_memory {
-                w.write_simple_element("cr:UsedMemory", &v.to_string())?;
-            }
-            if let Some(v) = self.used_network_up {
-                w.write_simple_element("cr:UsedNetworkUp", &v.to_string())?;
-            }
-            if let Some(v) = self.used_network_down {
-                w.write_simple_element("cr:UsedNetworkDown", &v.to_string())?;
-            }
-            if let Some(v) = self.iops {
-                w.write_simple_element("cr:IOPS", &v.to_string())?;
-            }
+            w.write_optional_element("cr:UsedCPU", self.used_cpu)?;
+            w.write_optional_element("cr:UsedMemory", self.used_memory)?;
+            w.write_optional_element("cr:UsedNetworkUp", self.used_network_up)?;
+            w.write_optional_element("cr:UsedNetworkDown", self.used_network_down)?;
+            w.write_optional_element("cr:IOPS", self.iops)?;
 
             w.write(XmlEvent::end_element())?;
 
@@ -247,32 +273,9 @@ pub mod v1 {
             let common = &self.common;
             w.write(XmlEvent::start_element("cr:CloudStorageRecord"))?;
 
-            w.write(
-                XmlEvent::start_element("cr:RecordIdentity")
-                    .attr("cr:createTime", &common.create_time.to_rfc3339())
-                    .attr(
-                        "cr:recordId",
-                        &format!(
-                            "ssc/{}/cr/{}/{}",
-                            common.site,
-                            common.instance_id,
-                            common.end_time.timestamp()
-                        ),
-                    ),
-            )?;
-            w.write(XmlEvent::end_element())?;
-
-            w.write_simple_element("cr:Site", &common.site)?;
-            w.write_simple_element("cr:Project", &common.project)?;
-            w.write_simple_element("cr:User", &common.user)?;
-            w.write_simple_element("cr:InstanceId", &common.instance_id)?;
+            common.write_identity_to(w)?;
             w.write_simple_element("cr:StorageType", &self.storage_type)?;
-            w.write_simple_element("cr:StartTime", &common.start_time.to_rfc3339())?;
-            w.write_simple_element("cr:EndTime", &common.end_time.to_rfc3339())?;
-            w.write_simple_element("cr:Duration", &common.duration.to_string())?;
-            w.write_simple_element("cr:Region", &common.region)?;
-            w.write_simple_element("cr:Resource", &common.resource)?;
-            w.write_simple_element("cr:Zone", &common.zone)?;
+            common.write_period_to(w)?;
             w.write_simple_element("cr:Cost", &common.cost.to_string())?;
             w.write_simple_element("cr:AllocatedDisk", &common.allocated_disk.to_string())?;
             w.write_simple_element("cr:FileCount", &self.file_count.to_string())?;
@@ -312,3 +315,50 @@ pub mod v1 {
         Ok(())
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn compute_record_xml(cr: &v1::CloudComputeRecord) -> String {
+        let mut out = Vec::new();
+        v1::write_xml_to(
+            &mut out,
+            std::iter::once(cr),
+            std::iter::empty::<&v1::CloudStorageRecord>(),
+        )
+        .unwrap();
+        String::from_utf8(out).unwrap()
+    }
+
+    #[test]
+    fn usage_fields_are_written_from_their_own_values() {
+        let mut cr = v1::CloudComputeRecord::example();
+        cr.used_cpu = Some(Decimal::from_str("0.5").unwrap());
+        cr.used_memory = Some(1024);
+        cr.used_network_up = Some(11);
+        cr.used_network_down = Some(22);
+        cr.iops = Some(33);
+
+        let xml = compute_record_xml(&cr);
+        assert!(xml.contains("<cr:UsedCPU>0.5</cr:UsedCPU>"));
+        assert!(xml.contains("<cr:UsedMemory>1024</cr:UsedMemory>"));
+        assert!(xml.contains("<cr:UsedNetworkUp>11</cr:UsedNetworkUp>"));
+        assert!(xml.contains("<cr:UsedNetworkDown>22</cr:UsedNetworkDown>"));
+        assert!(xml.contains("<cr:IOPS>33</cr:IOPS>"));
+    }
+
+    #[test]
+    fn unset_usage_fields_are_omitted() {
+        let xml = compute_record_xml(&v1::CloudComputeRecord::example());
+        for tag in &[
+            "UsedCPU",
+            "UsedMemory",
+            "UsedNetworkUp",
+            "UsedNetworkDown",
+            "IOPS",
+        ] {
+            assert!(!xml.contains(&format!("cr:{}", tag)), "unexpected {}", tag);
+        }
+    }
+}